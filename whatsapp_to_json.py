@@ -1,27 +1,65 @@
+import io
+import os
 import re
+import mmap
 import json
+import sys
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
 from datetime import datetime
+from functools import lru_cache
+from itertools import accumulate
 from typing import List, Dict, Optional, Tuple
 import random
 
+try:
+    # Optional: google-re2 matches in linear time with a DFA-based engine
+    import re2 as _url_re_module
+except ImportError:
+    _url_re_module = re
+
+
+# Pattern: "12/25/21, 12:51 PM - Username: Message"
+_LINE_RE = re.compile(
+    r'^(\d{1,2}/\d{1,2}/\d{2,4},\s+\d{1,2}:\d{2}\s+[AP]M)\s+-\s+([^:]+):\s+(.*)$')
+# The class is spelled out instead of using \S: RE2 treats \S as ASCII-only
+# while stdlib re is Unicode-aware, and the pattern must match the same in both
+_URL_RE = _url_re_module.compile('https?://[^\t\n\v\f\r \u00a0\u3000]+')
+# Matches one line and its terminator (\n, \r\n or a lone \r, like text mode)
+_LINE_SPLIT_RE = re.compile(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+_NL_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
+# Reused encoder; avoids json.dumps setting one up for every message
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+@lru_cache(maxsize=4096)
+def _parse_timestamp(timestamp_str: str) -> int:
+    """
+    Parse a WhatsApp timestamp string into integer epoch seconds.
+    Cached because consecutive messages often share the same minute.
+    """
+    timestamp = datetime.strptime(timestamp_str, '%m/%d/%y, %I:%M %p')
+    # Treat the naive local time as UTC so DST changes don't skew gaps
+    return calendar.timegm(timestamp.timetuple())
+
 
 def parse_whatsapp_line(line: str) -> Optional[Dict[str, str]]:
     """
     Parse a single WhatsApp chat line.
-    Returns dict with 'timestamp', 'username', 'message' or None if invalid.
+    Returns dict with 'timestamp' (epoch seconds), 'username', 'message' or None if invalid.
     """
-    # Pattern: "12/25/21, 12:51 PM - Username: Message"
-    pattern = r'^(\d{1,2}/\d{1,2}/\d{2,4},\s+\d{1,2}:\d{2}\s+[AP]M)\s+-\s+([^:]+):\s+(.*)$'
-    match = re.match(pattern, line)
+    match = _LINE_RE.match(line)
 
     if match:
         timestamp_str, username, message = match.groups()
         try:
             # Parse timestamp
-            timestamp = datetime.strptime(timestamp_str, '%m/%d/%y, %I:%M %p')
+            timestamp = _parse_timestamp(timestamp_str)
             return {
                 'timestamp': timestamp,
-                'username': username.strip(),
+                # Interned so repeated username comparisons are pointer checks
+                'username': sys.intern(username.strip()),
                 'message': message.strip()
             }
         except ValueError:
@@ -36,26 +74,35 @@ def parse_whatsapp_chat(file_path: str) -> List[Dict[str, str]]:
     """
     messages = []
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
     current_message = None
 
-    for line in lines:
-        line = line.rstrip('\n')
-
-        # Try to parse as new message
-        parsed = parse_whatsapp_line(line)
-
-        if parsed:
-            # Save previous message if exists
-            if current_message:
-                messages.append(current_message)
-            current_message = parsed
-        else:
-            # Continue previous message (multi-line)
-            if current_message and line.strip():
-                current_message['message'] += ' ' + line.strip()
+    with open(file_path, 'rb') as f:
+        # mmap cannot map an empty file
+        if os.fstat(f.fileno()).st_size == 0:
+            return messages
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # re scans the mapping directly, so only one line is copied at a time
+            for line_match in _LINE_SPLIT_RE.finditer(mm):
+                raw = line_match.group().rstrip(b'\r\n')
+
+                # New messages always start with a date, so anything else
+                # is a continuation line and can skip the regex entirely
+                if raw[:1].isdigit():
+                    parsed = parse_whatsapp_line(raw.decode('utf-8'))
+                else:
+                    parsed = None
+
+                if parsed:
+                    # Save previous message if exists
+                    if current_message:
+                        messages.append(current_message)
+                    current_message = parsed
+                elif current_message:
+                    # Continue previous message (multi-line)
+                    line = raw.decode('utf-8').strip()
+                    if line:
+                        current_message['message'] += ' ' + line
 
     # Add last message
     if current_message:
@@ -68,102 +115,109 @@ def contains_link(message: str) -> bool:
     """
     Check if message contains a URL.
     """
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    return bool(re.search(url_pattern, message))
+    # Cheap substring test first; most messages have no URL at all
+    if 'http://' not in message and 'https://' not in message:
+        return False
+    return bool(_URL_RE.search(message))
 
 
-def group_by_time_gap(messages: List[Dict], split_minutes: int,
-                      filter_media: bool, filter_links: bool,
-                      media_replacement: Optional[str],
-                      link_replacement: Optional[str]) -> List[List[Dict]]:
+def clean_messages(messages: List[Dict], filter_media: bool, filter_links: bool,
+                   media_replacement: Optional[str],
+                   link_replacement: Optional[str]) -> List[Dict]:
     """
-    Group messages into conversation blocks based on time gap.
+    Filter or replace media, link and empty messages, and flatten newlines.
+    Input messages are not modified; rewritten messages are returned as copies.
     """
-    if not messages:
-        return []
+    cleaned = []
 
-    blocks = []
-    current_block = []
+    for msg in messages:
+        message = msg['message']
 
-    for i, msg in enumerate(messages):
         # Handle media messages
-        if '<Media omitted>' in msg['message']:
+        if '<Media omitted>' in message:
             if filter_media:
                 continue
             elif media_replacement:
-                msg['message'] = media_replacement
+                message = media_replacement
 
         # Handle link messages
-        if contains_link(msg['message']):
+        if contains_link(message):
             if filter_links:
                 continue
             elif link_replacement:
-                msg['message'] = link_replacement
+                message = link_replacement
 
         # Skip empty messages
-        if not msg['message'].strip():
+        if not message.strip():
             continue
 
         # Remove newlines from message
-        msg['message'] = msg['message'].replace('\n', ' ').replace('\r', ' ')
-
-        if not current_block:
-            current_block.append(msg)
-        else:
-            # Check time difference
-            time_diff = (msg['timestamp'] - current_block[-1]
-                         ['timestamp']).total_seconds() / 60
-
-            if time_diff > split_minutes:
-                # Start new block
-                blocks.append(current_block)
-                current_block = [msg]
-            else:
-                current_block.append(msg)
+        if '\n' in message or '\r' in message:
+            message = message.translate(_NL_TABLE)
 
-    # Add last block
-    if current_block:
-        blocks.append(current_block)
+        # Copy only when the text changed; unchanged messages are shared
+        if message is not msg['message']:
+            msg = {**msg, 'message': message}
+        cleaned.append(msg)
 
-    return blocks
+    return cleaned
 
 
-def filter_single_speaker_blocks(blocks: List[List[Dict]], min_messages: int = 2) -> List[List[Dict]]:
+def group_by_time_gap(messages: List[Dict], split_minutes: int,
+                      filter_media: bool, filter_links: bool,
+                      media_replacement: Optional[str],
+                      link_replacement: Optional[str]) -> List[List[Dict]]:
     """
-    Remove blocks that have only one speaker or too few messages.
-
-    Args:
-        blocks: List of conversation blocks
-        min_messages: Minimum number of messages required per block
+    Group messages into conversation blocks based on time gap.
     """
-    filtered = []
+    messages = clean_messages(messages, filter_media, filter_links,
+                              media_replacement, link_replacement)
 
-    for block in blocks:
-        speakers = set(msg['username'] for msg in block)
-        if len(speakers) >= 2 and len(block) >= min_messages:
-            filtered.append(block)
+    if not messages:
+        return []
 
-    return filtered
+    # Start a new block wherever the gap to the previous message is too large
+    split_seconds = split_minutes * 60
+    timestamps = [msg['timestamp'] for msg in messages]
+    starts = [0]
+    starts.extend(i for i in range(1, len(timestamps))
+                  if timestamps[i] - timestamps[i - 1] > split_seconds)
+    ends = starts[1:] + [len(messages)]
+
+    return [messages[start:end] for start, end in zip(starts, ends)]
 
 
 def convert_to_json_format(blocks: List[List[Dict]], user_name: str,
-                           char_name: str) -> List[List[Tuple[str, str]]]:
+                           char_name: str,
+                           min_messages: int = 2) -> List[List[Tuple[str, str]]]:
     """
     Convert blocks to list of (key, value) tuples to allow duplicate keys.
+    Blocks with too few messages or without both speakers are dropped.
+
+    Args:
+        blocks: List of conversation blocks
+        user_name: Username to map to {{random_user_1}}
+        char_name: Username to map to {{char}}
+        min_messages: Minimum number of messages required per block
     """
     result = []
 
     for block in blocks:
+        # Cheap length check first to skip short blocks entirely
+        if len(block) < min_messages:
+            continue
+
         conversation = []
-        speakers_present = set()
+        has_user = False
+        has_char = False
 
         for msg in block:
             if msg['username'] == user_name:
                 key = "{{random_user_1}}"
-                speakers_present.add(key)
+                has_user = True
             elif msg['username'] == char_name:
                 key = "{{char}}"
-                speakers_present.add(key)
+                has_char = True
             else:
                 # Skip messages from unknown users
                 continue
@@ -171,83 +225,102 @@ def convert_to_json_format(blocks: List[List[Dict]], user_name: str,
             conversation.append((key, msg['message']))
 
         # Only add if conversation has both speakers
-        if len(speakers_present) >= 2 and conversation:
+        if has_user and has_char:
             result.append(conversation)
 
     return result
 
 
-def serialize_to_json_with_duplicate_keys(conversations: List[List[Tuple[str, str]]]) -> str:
+_JSON_HEADER = '{\n  "example_conversation": [\n'
+_JSON_FOOTER = '  ]\n}'
+
+
+def _serialize_conv(conv: List[Tuple[str, str]]) -> str:
     """
-    Custom JSON serialization that allows duplicate keys.
+    Serialize a single conversation into its indented JSON object block.
     """
-    lines = ['{']
-    lines.append('  "example_conversation": [')
+    if not conv:
+        return '    {\n    }'
 
-    for i, conv in enumerate(conversations):
-        lines.append('    {')
+    # Escape each value for JSON and join the whole body in one pass
+    body = ',\n'.join(f'      "{key}": {_encode(value)}' for key, value in conv)
+    return '    {\n' + body + '\n    }'
 
-        for j, (key, value) in enumerate(conv):
-            # Escape the value for JSON
-            escaped_value = json.dumps(value, ensure_ascii=False)
-            line = f'      "{key}": {escaped_value}'
 
-            # Add comma if not the last item
-            if j < len(conv) - 1:
-                line += ','
+def _assemble_json(pieces: List[str]) -> str:
+    """
+    Assemble pre-serialized conversation blocks into the final JSON document.
+    """
+    buf = io.StringIO()
+    buf.write(_JSON_HEADER)
 
-            lines.append(line)
+    for i, piece in enumerate(pieces):
+        if i:
+            buf.write(',\n')
+        buf.write(piece)
 
-        # Close conversation object
-        if i < len(conversations) - 1:
-            lines.append('    },')
-        else:
-            lines.append('    }')
+    if pieces:
+        buf.write('\n')
+    buf.write(_JSON_FOOTER)
 
-    lines.append('  ]')
-    lines.append('}')
+    return buf.getvalue()
 
-    return '\n'.join(lines)
 
+def serialize_to_json_with_duplicate_keys(conversations: List[List[Tuple[str, str]]]) -> str:
+    """
+    Custom JSON serialization that allows duplicate keys.
+    """
+    return _assemble_json([_serialize_conv(conv) for conv in conversations])
 
-def fit_to_character_limit(conversations: List[List[Tuple[str, str]]],
-                           character_limit: int) -> List[List[Tuple[str, str]]]:
+
+def _take_within_limit(items: list, lengths: List[int], character_limit: int) -> list:
     """
-    Ensure total JSON length doesn't exceed character limit.
-    Uses random sampling if needed.
+    Take the longest prefix of items whose serialized JSON stays within limit.
+    The prefix length is found by binary search over cumulative lengths.
     """
-    # First try sequential
-    result = []
+    # Empty document, plus one newline that closes the last conversation
+    overhead = len(_JSON_HEADER) + len(_JSON_FOOTER) + 1
 
-    for conv in conversations:
-        test_result = result + [conv]
-        test_json = serialize_to_json_with_duplicate_keys(test_result)
+    # Each conversation also adds a ",\n" separator, except the first one
+    bounds = list(accumulate(length + 2 for length in lengths))
+    count = bisect_right(bounds, character_limit - overhead + 2)
 
-        if len(test_json) <= character_limit:
-            result = test_result
-        else:
-            break
+    return items[:count]
+
+
+def _fit_items(items: list, lengths: List[int], character_limit: int,
+               seed: Optional[int] = None) -> list:
+    """
+    Select items whose serialized lengths fit the character limit.
+    Uses random sampling if not everything fits; pass a seed to make it reproducible.
+    """
+    # First try sequential
+    result = _take_within_limit(items, lengths, character_limit)
 
-    # If we got all conversations and still under limit, return
-    if len(result) == len(conversations):
+    # If we got all items and still under limit, return
+    if len(result) == len(items):
         return result
 
     # Otherwise, try random sampling to get more variety
-    if len(result) < len(conversations):
-        conversations_copy = conversations.copy()
-        random.shuffle(conversations_copy)
-        result = []
+    # Sample a random order of indices rather than copying the items themselves
+    # Without a seed, use the module-level generator so random.seed() still applies
+    rng = random if seed is None else random.Random(seed)
+    order = rng.sample(range(len(items)), len(items))
+    order = _take_within_limit(order, [lengths[i] for i in order],
+                               character_limit)
 
-        for conv in conversations_copy:
-            test_result = result + [conv]
-            test_json = serialize_to_json_with_duplicate_keys(test_result)
+    return [items[i] for i in order]
 
-            if len(test_json) <= character_limit:
-                result = test_result
-            else:
-                break
 
-    return result
+def fit_to_character_limit(conversations: List[List[Tuple[str, str]]],
+                           character_limit: int,
+                           seed: Optional[int] = None) -> List[List[Tuple[str, str]]]:
+    """
+    Ensure total JSON length doesn't exceed character limit.
+    Uses random sampling if needed; pass a seed to make it reproducible.
+    """
+    lengths = [len(_serialize_conv(conv)) for conv in conversations]
+    return _fit_items(conversations, lengths, character_limit, seed)
 
 
 def generate_conversation_json(input_file: str, output_file: str,
@@ -256,7 +329,8 @@ def generate_conversation_json(input_file: str, output_file: str,
                                user_name: str, char_name: str,
                                min_messages_per_conversation: int = 2,
                                media_replacement: Optional[str] = None,
-                               link_replacement: Optional[str] = None):
+                               link_replacement: Optional[str] = None,
+                               seed: Optional[int] = None):
     """
     Main function to convert WhatsApp chat to JSON format.
 
@@ -272,7 +346,11 @@ def generate_conversation_json(input_file: str, output_file: str,
         min_messages_per_conversation: Minimum messages required per conversation block (default: 2)
         media_replacement: If set and filter_media=False, replace media with this text (e.g., "<sends an attachment>")
         link_replacement: If set and filter_links=False, replace links with this text (e.g., "<sends a link>")
+        seed: Random seed for sampling conversations when they exceed character_limit (default: None)
     """
+    user_name = sys.intern(user_name)
+    char_name = sys.intern(char_name)
+
     print(f"📖 Reading WhatsApp chat from: {input_file}")
     messages = parse_whatsapp_chat(input_file)
     print(f"✅ Parsed {len(messages)} messages")
@@ -283,28 +361,47 @@ def generate_conversation_json(input_file: str, output_file: str,
     print(f"✅ Created {len(blocks)} conversation blocks")
 
     print(
-        f"🚫 Filtering blocks (min {min_messages_per_conversation} messages, 2+ speakers)...")
-    blocks = filter_single_speaker_blocks(
-        blocks, min_messages_per_conversation)
-    print(f"✅ {len(blocks)} blocks remaining after filtering")
-
-    print("🔄 Converting to JSON format...")
-    conversations = convert_to_json_format(blocks, user_name, char_name)
+        f"🔄 Converting to JSON format (min {min_messages_per_conversation} messages, 2+ speakers)...")
+    conversations = convert_to_json_format(blocks, user_name, char_name,
+                                           min_messages_per_conversation)
     print(f"✅ Generated {len(conversations)} conversation segments")
 
     print(f"📏 Fitting to {character_limit} character limit...")
-    conversations = fit_to_character_limit(conversations, character_limit)
-    print(f"✅ Final output: {len(conversations)} conversation segments")
+    # Serialize each conversation once and reuse the fragments for fitting
+    pieces = [_serialize_conv(conv) for conv in conversations]
+    pieces = _fit_items(pieces, [len(piece) for piece in pieces],
+                        character_limit, seed)
+    print(f"✅ Final output: {len(pieces)} conversation segments")
 
     # Create final JSON string with duplicate keys support
-    json_str = serialize_to_json_with_duplicate_keys(conversations)
+    json_str = _assemble_json(pieces)
 
     print(f"💾 Writing to: {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
         f.write(json_str)
 
     print(f"✅ Done! Final JSON size: {len(json_str)} characters")
-    print(f"📊 Total conversation blocks: {len(conversations)}")
+    print(f"📊 Total conversation blocks: {len(pieces)}")
+
+
+def _generate_one(options: Dict) -> None:
+    """
+    Worker entry point for generate_many; must be module-level to be picklable.
+    """
+    generate_conversation_json(**options)
+
+
+def generate_many(jobs: List[Dict], max_workers: Optional[int] = None):
+    """
+    Convert several WhatsApp chats in parallel, one worker process per file.
+
+    Args:
+        jobs: One dict of generate_conversation_json keyword arguments per chat
+        max_workers: Number of worker processes (default: one per CPU)
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results so worker exceptions are raised here
+        list(executor.map(_generate_one, jobs))
 
 
 # Example usage